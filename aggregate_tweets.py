@@ -0,0 +1,357 @@
+"""Streaming aggregation of tweet-level sentiment records into the dashboard's table.
+
+Reads JSON lines (optionally gzipped), one tweet per line with its resolved
+location, creation time and sentiment label, e.g.::
+
+    {"location": "Singapore", "created_at": "2022-01-01T08:15:00Z", "sentiment": "NEGATIVE"}
+
+Lines are parsed in fixed-size chunks and folded into running
+``(location, day)`` counts of each sentiment, so memory is bounded by the
+chunk size and the number of location-days, not by the input size. The counts
+are joined with the OWID covariates (stringency index, reproduction rate, ...)
+and written in the Spark output layout, one ``part-YYYY-MM.csv`` partition per
+month, which ``data_store`` picks up like any other partition.
+
+Every ``--checkpoint-every`` seconds, and at the end of the run, a checkpoint
+records how far each input file has been read together with the counts so far,
+as an Arrow file. A later run resumes from there: files that grew (or new
+files) are read from where the previous run stopped, and only the months that
+received new tweets are rewritten. The dashboard then re-parses just those
+partitions.
+
+    python aggregate_tweets.py tweets/ --covariates owid-covid-data.csv --output-dir data/
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import data_store
+from instrumentation import span
+
+CHECKPOINT_FILE = os.path.join(data_store.CACHE_DIR, "aggregate_checkpoint.arrow")
+CHECKPOINT_FORMAT = 2
+CHECKPOINT_SECONDS = 60
+CHUNK_LINES = 100_000
+INPUT_PATTERNS = ["*.jsonl", "*.jsonl.gz", "*.json", "*.json.gz"]
+
+SENTIMENT_LABELS = ["mixed", "negative", "neutral", "positive"]
+COVARIATES = ["stringency_index", "reproduction_rate", "new_deaths_smoothed_per_million",
+              "weekly_icu_admissions_per_million", "people_vaccinated_per_hundred",
+              "human_development_index"]
+OUTPUT_COLUMNS = (["location", "date"] + COVARIATES
+                  + ["%_of_{}_sentiments".format(label) for label in SENTIMENT_LABELS])
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+
+def discover_inputs(paths):
+    """Input files, expanding directories to the JSON lines files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted({match for pattern in INPUT_PATTERNS
+                                 for match in glob.glob(os.path.join(path, pattern))}))
+        else:
+            files.append(path)
+    # Checkpoint entries are keyed by absolute path, whatever directory a run starts from.
+    return [os.path.abspath(path) for path in files]
+
+
+def _field(record, path):
+    """``record[a][b]`` for the dotted ``path`` "a.b", or None if any part is missing."""
+    for key in path.split("."):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def parse_days(values):
+    """UTC calendar days of ISO 8601 or Twitter-style (``created_at``) timestamps; NaT if neither."""
+    values = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(values, format="ISO8601", utc=True, errors="coerce")
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing], format=TWITTER_DATE_FORMAT,
+                                         utc=True, errors="coerce")
+    return parsed.dt.tz_localize(None).dt.normalize()
+
+
+def count_chunk(lines, fields):
+    """Per (location, date) counts of each sentiment label in ``lines``, and the number skipped."""
+    location_field, date_field, sentiment_field = fields
+    locations, dates, sentiments = [], [], []
+    blank = 0
+    for line in lines:
+        if not line.strip():
+            blank += 1
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        locations.append(_field(record, location_field))
+        dates.append(_field(record, date_field))
+        sentiments.append(_field(record, sentiment_field))
+
+    chunk = pd.DataFrame({"location": locations, "date": parse_days(dates),
+                          "sentiment": pd.Series(sentiments, dtype=object).str.lower()})
+    chunk = chunk[chunk["location"].notna() & chunk["date"].notna()
+                  & chunk["sentiment"].isin(SENTIMENT_LABELS)]
+    counts = (chunk.groupby(["location", "date", "sentiment"]).size()
+              .unstack("sentiment", fill_value=0)
+              .reindex(columns=SENTIMENT_LABELS, fill_value=0))
+    return counts, len(lines) - blank - len(chunk)
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_chunks(path, offset, chunk_lines):
+    """Yield ``(lines, offset after them)`` from ``offset`` (bytes of the decompressed stream).
+
+    A last line without a newline is only taken once it parses: the file may
+    still be being written, and a later run will pick the line up. The same
+    goes for a gzipped file whose last member is incomplete.
+
+    Gzip streams cannot be seeked, so resuming a gzipped file decompresses it
+    again from the start up to ``offset``. That is far cheaper than parsing
+    the lines, and unchanged files are skipped before being opened, but inputs
+    that keep growing are best left uncompressed until they are complete.
+    """
+    with _open(path) as f:
+        f.seek(offset)
+        lines = []
+        try:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        break
+                lines.append(line)
+                offset += len(line)
+                if len(lines) == chunk_lines:
+                    yield lines, offset
+                    lines = []
+        except EOFError:
+            pass
+        if lines:
+            yield lines, offset
+
+
+class Checkpoint:
+    """Running counts and per-file read offsets.
+
+    Counts are kept as one row of ``counts`` per (location, day), found through
+    ``rows``, so folding in a chunk costs the chunk's size rather than that of
+    everything counted so far. ``save`` writes them atomically as an Arrow file
+    whose metadata holds the read offsets and the months not yet written out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.pending_months = set()
+        self.rows = {}
+        self.locations = []
+        self.days = []
+        self.counts = np.zeros((1024, len(SENTIMENT_LABELS)), dtype=np.int64)
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        if not os.path.exists(path):
+            return checkpoint
+        state = data_store.read_fingerprint(path)
+        if state is None or state.get("format") != CHECKPOINT_FORMAT:
+            raise ValueError("Checkpoint {!r} has an unsupported format; rerun with --restart"
+                             .format(path))
+        checkpoint.files = state["files"]
+        checkpoint.pending_months = set(state["pending_months"])
+        table = data_store.map_table(path)
+        checkpoint.locations = table.column("location").to_pylist()
+        checkpoint.days = table.column("date").to_numpy().astype(np.int64).tolist()
+        checkpoint.rows = {key: row for row, key in
+                           enumerate(zip(checkpoint.locations, checkpoint.days))}
+        counts = np.column_stack([table.column(label).to_numpy() for label in SENTIMENT_LABELS])
+        checkpoint.counts = np.zeros((max(2 * len(counts), 1024), len(SENTIMENT_LABELS)),
+                                     dtype=np.int64)
+        checkpoint.counts[:len(counts)] = counts
+        return checkpoint
+
+    def save(self):
+        size = len(self.rows)
+        columns = [pa.array(self.locations, pa.string()),
+                   pa.array(np.asarray(self.days, dtype=np.int32), pa.int32()).cast(pa.date32())]
+        columns += [pa.array(self.counts[:size, i]) for i in range(len(SENTIMENT_LABELS))]
+        table = pa.table(columns, names=["location", "date"] + SENTIMENT_LABELS)
+        state = {"format": CHECKPOINT_FORMAT, "files": self.files,
+                 "pending_months": sorted(self.pending_months)}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data_store.write_table(table, self.path, state)
+
+    def frame(self):
+        """The counts as a DataFrame indexed by ``(location, date)``."""
+        size = len(self.rows)
+        index = pd.MultiIndex.from_arrays(
+            [pd.Index(self.locations, dtype=object),
+             pd.DatetimeIndex(np.asarray(self.days, dtype="datetime64[D]"))],
+            names=["location", "date"])
+        return pd.DataFrame(self.counts[:size], index=index, columns=SENTIMENT_LABELS)
+
+    def start_offset(self, path, stat):
+        """Where to resume reading ``path``, or None if nothing was added since the last run."""
+        previous = self.files.get(path)
+        if previous is None:
+            return 0
+        if stat.st_size < previous.get("size", 0):
+            raise ValueError("{!r} shrank since it was aggregated; rerun with --restart"
+                             .format(path))
+        if (stat.st_size, stat.st_mtime_ns) == (previous.get("size"), previous.get("mtime_ns")):
+            return None
+        return previous["offset"]
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.locations)
+            self.locations.append(key[0])
+            self.days.append(key[1])
+            if row == len(self.counts):
+                self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)])
+        return row
+
+    def add(self, path, counts, offset):
+        dates = counts.index.get_level_values("date")
+        days = dates.values.astype("datetime64[D]").astype(np.int64).tolist()
+        keys = zip(counts.index.get_level_values("location"), days)
+        rows = np.fromiter((self._row(key) for key in keys), dtype=np.intp, count=len(counts))
+        # Keys are unique within a chunk, so a plain fancy-indexed add is exact.
+        self.counts[rows] += counts.to_numpy(dtype=np.int64)
+        self.pending_months.update(dates.unique().strftime("%Y-%m"))
+        self.files.setdefault(path, {})["offset"] = offset
+
+    def finish(self, path, stat):
+        """Record that ``path`` was read to the end as it was when ``stat`` was taken.
+
+        Until then its entry has no size, so a run interrupted part-way through
+        the file resumes it even though the file itself has not changed.
+        """
+        self.files.setdefault(path, {"offset": 0}).update(size=stat.st_size,
+                                                          mtime_ns=stat.st_mtime_ns)
+
+
+def load_covariates(path, keys):
+    """OWID covariates for the ``(location, date)`` pairs in ``keys``, read in chunks."""
+    locations = set(keys.get_level_values("location"))
+    dates = set(keys.get_level_values("date"))
+    frames = []
+    for chunk in pd.read_csv(path, usecols=["location", "date"] + COVARIATES,
+                             chunksize=CHUNK_LINES):
+        chunk = chunk[chunk["location"].isin(locations)].assign(
+            date=lambda frame: pd.to_datetime(frame["date"]))
+        frames.append(chunk[chunk["date"].isin(dates)])
+    covariates = pd.concat(frames).drop_duplicates(["location", "date"])
+    return covariates.set_index(["location", "date"]).reindex(keys)
+
+
+def month_table(counts, covariates):
+    """Rows of the dashboard's table: covariates and the percentage of each sentiment."""
+    table = covariates.copy()
+    totals = counts.sum(axis=1)
+    for label in SENTIMENT_LABELS:
+        table["%_of_{}_sentiments".format(label)] = counts[label] / totals * 100
+    table = table.reset_index().sort_values(["location", "date"])
+    table["date"] = ["{}/{}/{}".format(d.day, d.month, d.year) for d in table["date"]]
+    return table[OUTPUT_COLUMNS]
+
+
+def write_months(checkpoint, months, covariates_path, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    counts = checkpoint.frame()
+    month_of = counts.index.get_level_values("date").strftime("%Y-%m")
+    counts = counts[month_of.isin(months)]
+    month_of = month_of[month_of.isin(months)]
+    covariates = load_covariates(covariates_path, counts.index)
+    for month in sorted(months):
+        in_month = month_of == month
+        table = month_table(counts[in_month], covariates[in_month])
+        path = os.path.join(output_dir, "part-{}.csv".format(month))
+        # Dot-prefixed so a half-written file never matches the partition pattern.
+        tmp_path = os.path.join(output_dir, ".part-{}.csv.tmp".format(month))
+        table.to_csv(tmp_path, index=False, na_rep="")
+        os.replace(tmp_path, path)
+
+
+def aggregate(inputs, covariates_path, output_dir, checkpoint_path=CHECKPOINT_FILE,
+              chunk_lines=CHUNK_LINES, fields=("location", "created_at", "sentiment"),
+              restart=False, checkpoint_seconds=CHECKPOINT_SECONDS):
+    """Fold new input lines into the checkpoint and rewrite the months they touched."""
+    checkpoint = Checkpoint(checkpoint_path) if restart else Checkpoint.load(checkpoint_path)
+    lines_read = skipped = 0
+    saved = time.monotonic()
+    for path in discover_inputs(inputs):
+        # Taken before reading, so lines appended meanwhile are picked up next run.
+        stat = os.stat(path)
+        offset = checkpoint.start_offset(path, stat)
+        if offset is None:
+            continue
+        for lines, offset in read_chunks(path, offset, chunk_lines):
+            with span("aggregate_chunk", lines=len(lines)):
+                counts, chunk_skipped = count_chunk(lines, fields)
+                checkpoint.add(path, counts, offset)
+            lines_read += len(lines)
+            skipped += chunk_skipped
+            # Offsets are saved with the counts they led to, so an interrupted
+            # run only re-reads what was added since the last save.
+            if time.monotonic() - saved >= checkpoint_seconds:
+                with span("aggregate_checkpoint", rows=len(checkpoint.rows)):
+                    checkpoint.save()
+                saved = time.monotonic()
+        checkpoint.finish(path, stat)
+
+    checkpoint.save()
+    months = set(checkpoint.pending_months)
+    with span("aggregate_write", months=len(months)):
+        write_months(checkpoint, months, covariates_path, output_dir)
+    checkpoint.pending_months.clear()
+    checkpoint.save()
+    return lines_read, skipped, sorted(months)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("inputs", nargs="+", help="JSON lines files or directories of them")
+    parser.add_argument("--covariates", required=True, help="OWID covid-data CSV")
+    parser.add_argument("--output-dir", required=True,
+                        help="where the part-YYYY-MM.csv partitions are written")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES)
+    parser.add_argument("--checkpoint-every", type=float, default=CHECKPOINT_SECONDS,
+                        help="seconds between checkpoints while reading (default: %(default)s)")
+    parser.add_argument("--location-field", default="location",
+                        help="dotted path of the location in each record, e.g. place.country")
+    parser.add_argument("--date-field", default="created_at")
+    parser.add_argument("--sentiment-field", default="sentiment")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the checkpoint and aggregate every input from the start")
+    args = parser.parse_args()
+
+    lines_read, skipped, months = aggregate(
+        args.inputs, args.covariates, args.output_dir, args.checkpoint, args.chunk_lines,
+        (args.location_field, args.date_field, args.sentiment_field), args.restart,
+        args.checkpoint_every)
+    print("Read {:,} new lines ({:,} skipped); wrote {} month(s): {}".format(
+        lines_read, skipped, len(months), ", ".join(months) or "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,100 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.io as pio
 import matplotlib.pyplot as plt
 import datetime as dt
+import os
 from dateutil.relativedelta import relativedelta
-from plotly.subplots import make_subplots
 from scipy.stats.stats import kendalltau
 
+import charts
+import data_browser
+import data_store
+import rolling_correlations
+from instrumentation import span, tracer
+from correlation import CorrelationEngine
+from data_index import LocationIndex
+from range_stats import RangeStats
+from result_cache import ResultCache
+
 st.set_option('deprecation.showPyplotGlobalUse', False)
 
-df = pd.read_csv("part-00000-47944130-32bd-4816-8036-a44d53839f87-c000.csv")
-df['date'] = pd.to_datetime(df['date'], format='%d/%m/%Y')
-df['date'] = df['date'].dt.date
-df = df.sort_values(by=['location','date'], ascending=True)
+tracer.begin()
+
+# Directory holding the Spark job's part-*.csv output partitions.
+DATA_DIR = "."
+# Written by `python rolling_correlations.py`.
+ROLLING_PATH = os.path.join(data_store.CACHE_DIR, rolling_correlations.ROLLING_FILE)
+
+
+@st.cache_resource(max_entries=1)
+def load_data(source_version):
+    # Shared by every session; the version argument forces a reload when partitions change.
+    with span("load"):
+        return data_store.load_table(DATA_DIR)
+
+
+@st.cache_resource(max_entries=1)
+def load_index(source_version):
+    table = load_data(source_version)
+    with span("index_build", rows=table.num_rows):
+        return LocationIndex(table)
+
+
+@st.cache_resource(max_entries=1)
+def load_range_stats(source_version):
+    index = load_index(source_version)
+    with span("range_stats_build", rows=len(index)):
+        return RangeStats.cached(index, load_data(source_version))
+
+
+@st.cache_resource(max_entries=1)
+def load_correlation_engine(source_version):
+    # Tables are memoised in the shared result cache, so the engine keeps none.
+    return CorrelationEngine(load_index(source_version), maxsize=0,
+                             range_stats=load_range_stats(source_version))
+
+
+@st.cache_resource(max_entries=1)
+def load_rolling_index(source_version, rolling_version):
+    # (index, window lengths), or None until the batch job has been run on the current data.
+    with span("rolling_load"):
+        table = rolling_correlations.load(ROLLING_PATH, load_data(source_version))
+        if table is None:
+            return None
+        return LocationIndex(table), rolling_correlations.windows_of(table)
+
+
+@st.cache_resource
+def load_result_cache():
+    return ResultCache()
+
+
+def timed_json(stage, build_figure, df_filtered):
+    with span(stage, rows=len(df_filtered)):
+        return build_figure(df_filtered).to_json()
+
+
+def multi_country_figure_json(countries, start_date, end_date):
+    with span("figure_multi") as building:
+        fig, points_sent, points_total = charts.multi_country_figure(
+            index, countries, start_date, end_date)
+        building.tag(rows=points_total)
+        return fig.to_json(), points_sent, points_total
+
+
+data_version = data_store.source_version(DATA_DIR)
+index = load_index(data_version)
+range_stats = load_range_stats(data_version)
+correlation_engine = load_correlation_engine(data_version)
+result_cache = load_result_cache()
+result_cache.sync_version(data_version)
+
+SENTIMENT_LABELS = {"%_of_positive_sentiments": "Positive",
+                    "%_of_negative_sentiments": "Negative",
+                    "%_of_neutral_sentiments": "Neutral",
+                    "%_of_mixed_sentiments": "Mixed"}
 
 st.title("Sentiment Analysis of Tweets about COVID-19")
 st.sidebar.title("Lets' get started!")
@@ -25,9 +107,11 @@ st.sidebar.markdown(
 def run():
 
     pages = ["Visualize Single Country/Area",
-             "Visualize Multiple Countries/Areas"]
+             "Visualize Multiple Countries/Areas",
+             "Visualize Correlation Over Time"]
     st.sidebar.subheader("First, choose a visualization type...")
     section = st.sidebar.radio('Visualization selected:', pages)
+    tracer.tag(page=section)
     countries = ['Singapore', 'United States', 'Italy', 'Germany', 'Norway', 'United Kingdom', 'Australia', 'Taiwan',
                  'Hong Kong', 'China', 'Brazil', 'France', 'New Zealand', 'South Korea', 'Japan',
                  'Vietnam', 'India', 'Canada', 'Saudi Arabia', 'Bahrain',
@@ -64,37 +148,25 @@ def run():
 
         if st.sidebar.button('Create Visualization'):
 
-            df_filtered = df.loc[df['location'] == country_selected]
-            df_filtered = df_filtered.loc[(df_filtered['date'] >= start_date) & (
-                df_filtered['date'] <= end_date)]
-            corr_df1 = df_filtered.corr(method='pearson')
-            corr_df2 = df_filtered.corr(method='kendall')
-            corr_df3 = df_filtered.corr(method='spearman')
+            view_key = ("single", country_selected,
+                        start_date, end_date, data_version)
+            tracer.tag(countries=1)
+            with span("filter", country=country_selected) as filtering:
+                df_filtered = index.frame(
+                    country_selected, start_date, end_date)
+                filtering.tag(rows=len(df_filtered))
+            correlations = result_cache.get_or_compute(
+                view_key + ("correlations",),
+                lambda: correlation_engine.tables(country_selected, start_date, end_date))
 
             #fig = px.line(df_filtered, x="date", y=df.columns[2:8])
 
-            fig1 = make_subplots(rows=1, cols=1)
-            fig1.add_scatter(
-                x=df_filtered["date"], y=df_filtered["stringency_index"], mode='lines', name="stringency_index")
-            fig1.add_scatter(x=df_filtered["date"], y=df_filtered["%_of_positive_sentiments"],
-                             mode='lines', name="%_of_positive_sentiments")
-            fig1.add_scatter(x=df_filtered["date"], y=df_filtered["%_of_negative_sentiments"],
-                             mode='lines', name="%_of_negative_sentiments")
-            fig1.add_scatter(
-                x=df_filtered["date"], y=df_filtered["%_of_mixed_sentiments"], mode='lines', name="%_of_mixed_sentiments")
-            fig1.add_scatter(x=df_filtered["date"], y=df_filtered["%_of_neutral_sentiments"],
-                             mode='lines', name="%_of_neutral_sentiments")
-
-            fig1.update_layout(
-                xaxis_title="Date",
-                yaxis_title="Values",
-                title="<b>Chart 1: Stringency Index vs Time & Percentage of Sentiments vs Time</b>",
-                font=dict(
-                    size=13
-                )
-            )
-
-            st.plotly_chart(fig1)
+            fig1 = pio.from_json(result_cache.get_or_compute(
+                view_key + ("chart1",),
+                lambda: timed_json("figure_chart1", charts.stringency_figure, df_filtered)))
+
+            with span("st_plotly_chart", chart="chart1"):
+                st.plotly_chart(fig1)
 
             st.info(
                 "🛈 Click on the respective variable legend (on the right of the chart) to select or deselect it.")
@@ -116,67 +188,28 @@ def run():
 
                 st.info("🛈 Note that if any of correlation values are displayed as <NA>, then most probably, it is because one of the variables was constant during the selected time period!")
 
-                data1 = {'Correlation values': [
-                    corr_df1.iat[0, 8], corr_df2.iat[0, 8], corr_df3.iat[0, 8]]}
-                data2 = {'Correlation values': [
-                    corr_df1.iat[0, 6], corr_df2.iat[0, 6], corr_df3.iat[0, 6]]}
-                data3 = {'Correlation values': [
-                    corr_df1.iat[0, 7], corr_df2.iat[0, 7], corr_df3.iat[0, 7]]}
-                data4 = {'Correlation values': [
-                    corr_df1.iat[0, 5], corr_df2.iat[0, 5], corr_df3.iat[0, 5]]}
-
-                cus_df1 = pd.DataFrame.from_dict(data1, orient='index',
-                                                 columns=['Pearson', 'Kendall', 'Spearman'])
-                cus_df2 = pd.DataFrame.from_dict(data2, orient='index',
-                                                 columns=['Pearson', 'Kendall', 'Spearman'])
-                cus_df3 = pd.DataFrame.from_dict(data3, orient='index',
-                                                 columns=['Pearson', 'Kendall', 'Spearman'])
-                cus_df4 = pd.DataFrame.from_dict(data4, orient='index',
-                                                 columns=['Pearson', 'Kendall', 'Spearman'])
+                for sentiment, label in SENTIMENT_LABELS.items():
+                    st.markdown(
+                        "Correlation between {} Sentiments and Stringency Index".format(label))
+                    st.table(correlations["stringency_index"].loc[[sentiment]].set_axis(
+                        ['Correlation values']))
 
-                st.markdown(
-                    "Correlation between Positive Sentiments and Stringency Index")
-                st.table(cus_df1)
-                st.markdown(
-                    "Correlation between Negative Sentiments and Stringency Index")
-                st.table(cus_df2)
-                st.markdown(
-                    "Correlation between Neutral Sentiments and Stringency Index")
-                st.table(cus_df3)
-                st.markdown(
-                    "Correlation between Mixed Sentiments and Stringency Index")
-                st.table(cus_df4)
+            summary_statistics = st.expander('Summary statistics')
+            with summary_statistics:
+                st.info("🛈 Missing values are left out, so count shows how many days had a value for each metric during the selected time period.")
+                st.table(range_stats.summary(
+                    country_selected, start_date, end_date))
 
             if (country_selected == "Hong Kong"):
                 st.markdown(
                     "Sorry, we were unable to find covid reproduction rate in Hong Kong!")
             else:
-                fig2 = make_subplots(rows=1, cols=1)
-                fig2.add_scatter(
-                    x=df_filtered["date"], y=df_filtered["reproduction_rate"], mode='lines', name="reproduction_rate")
-                fig2.add_scatter(x=df_filtered["date"], y=[
-                    val / 100 for val in df_filtered["%_of_positive_sentiments"]],
-                    mode='lines', name="proportion_of_positive_sentiments")
-                fig2.add_scatter(x=df_filtered["date"], y=[
-                    val / 100 for val in df_filtered["%_of_negative_sentiments"]],
-                    mode='lines', name="proportion_of_negative_sentiments")
-                fig2.add_scatter(x=df_filtered["date"], y=[
-                    val / 100 for val in df_filtered["%_of_mixed_sentiments"]],
-                    mode='lines', name="proportion_of_mixed_sentiments")
-                fig2.add_scatter(x=df_filtered["date"], y=[
-                    val / 100 for val in df_filtered["%_of_neutral_sentiments"]],
-                    mode='lines', name="proportion_of_neutral_sentiments")
-
-                fig2.update_layout(
-                    title="<b>Chart 2: Reproduction Rate vs Time & Proportions of Sentiments vs Time</b>",
-                    xaxis_title="Date",
-                    yaxis_title="Values",
-                    font=dict(
-                        size=13
-                    )
-                )
-
-                st.plotly_chart(fig2)
+                fig2 = pio.from_json(result_cache.get_or_compute(
+                    view_key + ("chart2",),
+                    lambda: timed_json("figure_chart2", charts.reproduction_figure, df_filtered)))
+
+                with span("st_plotly_chart", chart="chart2"):
+                    st.plotly_chart(fig2)
 
                 st.info(
                     "🛈 Click on the respective variable legend (on the right of the chart) to select or deselect it.")
@@ -196,42 +229,13 @@ def run():
 
                 correlation_values = st.expander('Correlation values')
                 with correlation_values:
-                    # st.table(corr_df1)
-                    # st.table(corr_df2)
-                    # st.table(corr_df3)
-
                     st.info("🛈 Note that if any of correlation values are displayed as <NA>, then most probably, it is because one of the variables was constant during the selected time period!")
 
-                    data1 = {'Correlation values': [
-                        corr_df1.iat[1, 8], corr_df2.iat[1, 8], corr_df3.iat[1, 8]]}
-                    data2 = {'Correlation values': [
-                        corr_df1.iat[1, 6], corr_df2.iat[1, 6], corr_df3.iat[1, 6]]}
-                    data3 = {'Correlation values': [
-                        corr_df1.iat[1, 7], corr_df2.iat[1, 7], corr_df3.iat[1, 7]]}
-                    data4 = {'Correlation values': [
-                        corr_df1.iat[1, 5], corr_df2.iat[1, 5], corr_df3.iat[1, 5]]}
-
-                    cus_df1 = pd.DataFrame.from_dict(data1, orient='index',
-                                                     columns=['Pearson', 'Kendall', 'Spearman'])
-                    cus_df2 = pd.DataFrame.from_dict(data2, orient='index',
-                                                     columns=['Pearson', 'Kendall', 'Spearman'])
-                    cus_df3 = pd.DataFrame.from_dict(data3, orient='index',
-                                                     columns=['Pearson', 'Kendall', 'Spearman'])
-                    cus_df4 = pd.DataFrame.from_dict(data4, orient='index',
-                                                     columns=['Pearson', 'Kendall', 'Spearman'])
-
-                    st.markdown(
-                        "Correlation between Positive Sentiments and Reproduction Rate")
-                    st.table(cus_df1)
-                    st.markdown(
-                        "Correlation between Negative Sentiments and Reproduction Rate")
-                    st.table(cus_df2)
-                    st.markdown(
-                        "Correlation between Neutral Sentiments and Reproduction Rate")
-                    st.table(cus_df3)
-                    st.markdown(
-                        "Correlation between Mixed Sentiments and Reproduction Rate")
-                    st.table(cus_df4)
+                    for sentiment, label in SENTIMENT_LABELS.items():
+                        st.markdown(
+                            "Correlation between {} Sentiments and Reproduction Rate".format(label))
+                        st.table(correlations["reproduction_rate"].loc[[sentiment]].set_axis(
+                            ['Correlation values']))
 
         else:
             st.markdown(
@@ -250,13 +254,14 @@ def run():
             see_raw_data = st.expander(
                 'Raw Data (that was ingested, processed and aggregated by us)')
             with see_raw_data:
-                st.dataframe(data=df.reset_index(drop=True))
+                data_browser.raw_data_browser(index, key="single")
 
-    else:
+    elif section == "Visualize Multiple Countries/Areas":
         st.sidebar.subheader(
             "Now, select the countries/areas that you want to compare...")
         selected_countries = st.sidebar.multiselect(
             "Select and deselect the countries/areas that you want to compare. You can clear the current selection by clicking the corresponding x-button on the right", countries, default=countries)
+        tracer.tag(countries=len(selected_countries))
 
         st.sidebar.subheader("Now, select a time frame...")
         start_date = st.sidebar.date_input(
@@ -280,29 +285,16 @@ def run():
             #df_filtered = df_filtered.loc[(df_filtered['date'] >= start_date) & (df_filtered['date'] <= end_date)]
             #fig = px.line(df_filtered, x="date", y=df.columns[2:8])
 
-            fig = make_subplots(rows=1, cols=1)
-
-            for i in range(0, len(selected_countries)):
-                country = selected_countries[i]
-                df_filtered_i = df.loc[df['location'] == country]
-                df_filtered_i = df_filtered_i.loc[(df_filtered_i['date'] >= start_date) & (
-                    df_filtered_i['date'] <= end_date)]
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["stringency_index"],
-                                mode='lines', name="{cname}-stringency_index".format(cname=country))
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["reproduction_rate"],
-                                mode='lines', name="{cname}-reproduction_rate".format(cname=country))
-                # fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["new_deaths_per_million"],
-                #                mode='lines', name="{cname}-new_deaths_per_million".format(cname=country))
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["%_of_positive_sentiments"],
-                                mode='lines', name="{cname}-%_of_positive_sentiments".format(cname=country))
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["%_of_negative_sentiments"],
-                                mode='lines', name="{cname}-%_of_negative_sentiments".format(cname=country))
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["%_of_mixed_sentiments"],
-                                mode='lines', name="{cname}-%_of_mixed_sentiments".format(cname=country))
-                fig.add_scatter(x=df_filtered_i["date"], y=df_filtered_i["%_of_neutral_sentiments"],
-                                mode='lines', name="{cname}-%_of_neutral_sentiments".format(cname=country))
-
-            st.plotly_chart(fig)
+            view_key = ("multiple", tuple(selected_countries),
+                        start_date, end_date, data_version)
+            fig_json, points_sent, points_total = result_cache.get_or_compute(
+                view_key, lambda: multi_country_figure_json(selected_countries, start_date, end_date))
+            fig = pio.from_json(fig_json)
+
+            with span("st_plotly_chart", chart="multi"):
+                st.plotly_chart(fig)
+            st.caption("Showing {:,} of {:,} data points.".format(
+                points_sent, points_total))
 
             st.info(
                 "🛈 Click on the respective variable legend (on the right of the chart) to select or deselect it.")
@@ -332,8 +324,54 @@ def run():
 
             see_raw_data = st.expander('Raw Data')
             with see_raw_data:
-                st.dataframe(data=df.reset_index(drop=True))
+                data_browser.raw_data_browser(index, key="multiple")
+
+    else:
+        rolling = load_rolling_index(
+            data_version, rolling_correlations.file_version(ROLLING_PATH))
+        if rolling is None:
+            st.warning("Rolling correlations have not been computed for the current data yet. "
+                       "Run `python rolling_correlations.py` and reload this page.")
+            return
+        rolling_index, windows_available = rolling
+
+        st.sidebar.subheader("Now, select a country to visualize...")
+        country_selected = st.sidebar.selectbox('Country Selected:', countries)
+
+        st.sidebar.subheader("Now, select the variables to correlate...")
+        driver_selected = st.sidebar.selectbox(
+            'Compare:', ["stringency_index", "reproduction_rate"])
+        sentiment_selected = st.sidebar.selectbox(
+            'Against:', list(SENTIMENT_LABELS), format_func=SENTIMENT_LABELS.get)
+        windows_selected = st.sidebar.multiselect(
+            'Window lengths (days):', windows_available, default=windows_available)
+
+        if (country_selected == "Hong Kong" and driver_selected == "reproduction_rate"):
+            st.markdown(
+                "Sorry, we were unable to find covid reproduction rate in Hong Kong!")
+        else:
+            with span("figure_rolling", country=country_selected):
+                fig = charts.rolling_correlation_figure(
+                    rolling_index, country_selected, driver_selected, sentiment_selected,
+                    windows_selected)
+            with span("st_plotly_chart", chart="rolling"):
+                st.plotly_chart(fig)
+
+            st.info("🛈 Each point is the correlation over the window of days ending on that date. Gaps mean one of the variables was missing or constant during that window.")
 
 
 if __name__ == '__main__':
     run()
+
+    if tracer.enabled:
+        cache_stats = result_cache.stats()
+        for name in ("hits", "misses", "evictions"):
+            tracer.counter("result_cache_" + name, cache_stats[name])
+        for name in ("entries", "bytes"):
+            tracer.gauge("result_cache_" + name, cache_stats[name])
+
+        debug_panel = st.sidebar.expander('Performance (debug)')
+        with debug_panel:
+            st.dataframe(data=pd.DataFrame(tracer.spans()))
+            st.json(cache_stats)
+    tracer.end()
@@ -0,0 +1,277 @@
+"""Headless benchmarks for the dashboard's hot path.
+
+Times the stages ``app.py`` runs on a rerun (loading, location/date filtering,
+the three correlation methods, single- and multi-country figure construction)
+without a Streamlit server, on either an existing Spark output directory or
+synthetic data generated at the requested scale. Results are written as JSON
+so runs can be compared across commits, and the run fails (exit code 1) when a
+stage exceeds its threshold in ``benchmark_thresholds.json`` or regresses
+against a baseline result file.
+
+    python benchmark.py --locations 1000 --days 730
+    python benchmark.py --data /path/to/spark/output --baseline bench_results/abc1234.json
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import charts
+import data_store
+import synthetic_data
+from correlation import (DRIVERS, SENTIMENTS, CorrelationEngine, average_rank,
+                         dense_rank, kendall_tau, pearson)
+from data_index import LocationIndex, from_day
+from range_stats import RangeStats
+
+THRESHOLDS_FILE = "benchmark_thresholds.json"
+RESULTS_DIR = "bench_results"
+# The multi-country page defaults to this many countries.
+MULTI_COUNTRIES = 23
+
+STAGES = []
+
+
+def stage(repeats=5):
+    """Register ``setup(ctx) -> callable``; the callable is what gets timed."""
+    def register(setup):
+        STAGES.append((setup.__name__, setup, repeats))
+        return setup
+    return register
+
+
+class Context:
+
+    def __init__(self, data_dir, cache_dir, windows, seed):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.table = data_store.load_table(data_dir, cache_dir)
+        self.index = LocationIndex(self.table)
+        self.range_stats = RangeStats(self.index)
+
+        rng = np.random.default_rng(seed)
+        locations = self.index.locations
+        self.windows = []
+        for location in rng.choice(locations, windows):
+            start, stop = self.index.bounds[location]
+            first = self.index.days[start]
+            last = self.index.days[stop - 1]
+            lo = int(rng.integers(first, last + 1))
+            hi = min(last, lo + int(rng.integers(7, 91)))
+            self.windows.append((location, from_day(lo), from_day(hi)))
+        self.multi_countries = list(rng.choice(locations, min(MULTI_COUNTRIES, len(locations)),
+                                               replace=False))
+
+    def window_pairs(self):
+        for location, start_date, end_date in self.windows:
+            rows = self.index.rows(location, start_date, end_date)
+            for driver in DRIVERS:
+                for sentiment in SENTIMENTS:
+                    x = self.index.arrays[driver][rows].astype(np.float64)
+                    y = self.index.arrays[sentiment][rows].astype(np.float64)
+                    valid = ~(np.isnan(x) | np.isnan(y))
+                    yield location, start_date, end_date, driver, sentiment, x[valid], y[valid]
+
+
+@stage(repeats=3)
+def load_cold(ctx):
+    def run():
+        shutil.rmtree(ctx.cache_dir, ignore_errors=True)
+        data_store.load_table(ctx.data_dir, ctx.cache_dir)
+    return run
+
+
+@stage()
+def load_warm(ctx):
+    return lambda: data_store.load_table(ctx.data_dir, ctx.cache_dir)
+
+
+@stage()
+def index_build(ctx):
+    return lambda: LocationIndex(ctx.table)
+
+
+@stage(repeats=3)
+def range_stats_build(ctx):
+    return lambda: RangeStats(ctx.index)
+
+
+@stage()
+def filter_single(ctx):
+    return lambda: [ctx.index.frame(*window) for window in ctx.windows]
+
+
+@stage()
+def filter_multi(ctx):
+    first, last = ctx.index.min_date, ctx.index.max_date
+    return lambda: [ctx.index.rows(country, first, last) for country in ctx.multi_countries]
+
+
+@stage()
+def corr_pearson(ctx):
+    return lambda: [ctx.range_stats.pearson(*window[:1], driver, sentiment, *window[1:])
+                    for window in ctx.windows for driver in DRIVERS for sentiment in SENTIMENTS]
+
+
+@stage()
+def corr_kendall(ctx):
+    pairs = [(x, y) for *_, x, y in ctx.window_pairs()]
+    return lambda: [kendall_tau(dense_rank(x), dense_rank(y)) for x, y in pairs]
+
+
+@stage()
+def corr_spearman(ctx):
+    pairs = [(x, y) for *_, x, y in ctx.window_pairs()]
+    return lambda: [pearson(average_rank(dense_rank(x)), average_rank(dense_rank(y)))
+                    for x, y in pairs]
+
+
+@stage()
+def corr_engine(ctx):
+    engine = CorrelationEngine(ctx.index, maxsize=0, range_stats=ctx.range_stats)
+    return lambda: [engine.tables(*window) for window in ctx.windows]
+
+
+@stage()
+def figure_single(ctx):
+    frames = [ctx.index.frame(*window) for window in ctx.windows[:10]]
+    return lambda: [(charts.stringency_figure(frame).to_json(),
+                     charts.reproduction_figure(frame).to_json()) for frame in frames]
+
+
+@stage(repeats=3)
+def figure_multi(ctx):
+    first, last = ctx.index.min_date, ctx.index.max_date
+    return lambda: charts.multi_country_figure(
+        ctx.index, ctx.multi_countries, first, last)[0].to_json()
+
+
+def run_benchmarks(ctx, only=None):
+    results = {}
+    for name, setup, repeats in STAGES:
+        if only and name not in only:
+            continue
+        run = setup(ctx)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        results[name] = {"median_s": statistics.median(timings), "min_s": min(timings),
+                         "repeats": repeats}
+        print("{:<20} median {:9.4f}s   min {:9.4f}s".format(
+            name, results[name]["median_s"], results[name]["min_s"]))
+    return results
+
+
+def check_empty_windows(ctx):
+    """Failures where an empty or reversed date range gives a non-empty summary."""
+    failures = []
+    for location, start_date, end_date in ctx.windows[:10]:
+        before = start_date - dt.timedelta(days=1)
+        for first, last in ((end_date, start_date - dt.timedelta(days=7)), (start_date, before)):
+            summary = ctx.range_stats.summary(location, first, last)
+            if (summary["count"] != 0).any() or summary.drop(columns="count").notna().any().any():
+                failures.append("summary of {} from {} to {} is not empty".format(
+                    location, first, last))
+    return failures
+
+
+def check(results, thresholds, baseline, tolerance):
+    """Return a list of human-readable failures."""
+    failures = []
+    for name, result in results.items():
+        limit = thresholds.get(name)
+        if limit is not None and result["median_s"] > limit:
+            failures.append("{}: {:.4f}s exceeds threshold {:.4f}s".format(
+                name, result["median_s"], limit))
+        previous = baseline.get(name)
+        if previous and result["median_s"] > previous["median_s"] * (1 + tolerance):
+            failures.append("{}: {:.4f}s is more than {:.0%} slower than baseline {:.4f}s".format(
+                name, result["median_s"], tolerance, previous["median_s"]))
+    return failures
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--data", help="Spark output directory (default: generate synthetic data)")
+    parser.add_argument("--locations", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--windows", type=int, default=200,
+                        help="random (location, date range) queries per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="*", help="only run these stages")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE)
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against --baseline (0.25 = 25%%)")
+    parser.add_argument("--output", help="result file (default: bench_results/<commit>.json)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="dashboard-bench-")
+    try:
+        data_dir = args.data
+        scale = {"data": data_dir}
+        if data_dir is None:
+            data_dir = os.path.join(work_dir, "data")
+            df = synthetic_data.generate(args.locations, args.days, seed=args.seed)
+            synthetic_data.write_partitions(df, data_dir, args.partitions, seed=args.seed)
+            scale = {"locations": args.locations, "days": args.days,
+                     "partitions": args.partitions}
+        ctx = Context(data_dir, os.path.join(work_dir, "cache"), args.windows, args.seed)
+        scale.update(rows=ctx.table.num_rows, windows=args.windows)
+        print("Benchmarking {:,} rows, {:,} locations".format(
+            ctx.table.num_rows, len(ctx.index.locations)))
+        results = run_benchmarks(ctx, args.stages)
+        errors = check_empty_windows(ctx)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit = _commit()
+    report = {"commit": commit, "timestamp": dt.datetime.now().isoformat(timespec="seconds"),
+              "scale": scale, "results": results}
+    output = args.output or os.path.join(RESULTS_DIR, "{}.json".format(commit))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(output))
+
+    thresholds = {}
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            calibrated = json.load(f)
+        # Absolute limits only mean something at the scale they were set for.
+        if all(scale.get(key) == value for key, value in calibrated["scale"].items()):
+            thresholds = calibrated["stages"]
+        else:
+            print("Skipping {}: calibrated for {}".format(args.thresholds, calibrated["scale"]))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    failures = check(results, thresholds, baseline, args.tolerance)
+    for error in errors:
+        print("ERROR " + error)
+    for failure in failures:
+        print("REGRESSION " + failure)
+    raise SystemExit(1 if failures or errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Plotly figure builders for the dashboard charts.
+
+Chart 1 and Chart 2 of the single-country view take the filtered rows of one
+location. The multi-country chart can hold hundreds of traces, so it is built in one
+batch from per-trace arrays rather than through repeated ``add_scatter`` calls.
+Traces longer than the chart's pixel width are downsampled with
+Largest-Triangle-Three-Buckets (LTTB), which keeps the visual peaks and
+troughs, and the whole figure switches to WebGL (``scattergl``) once the point
+count gets large. The correlation-over-time chart only plots columns of the
+precomputed rolling-correlation file.
+"""
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from correlation import METHODS
+from instrumentation import span
+from rolling_correlations import column_name
+
+MULTI_COUNTRY_METRICS = ["stringency_index", "reproduction_rate",
+                         "%_of_positive_sentiments", "%_of_negative_sentiments",
+                         "%_of_mixed_sentiments", "%_of_neutral_sentiments"]
+
+# Chart 1/2 trace order: positive, negative, mixed, neutral.
+SENTIMENTS = ["%_of_positive_sentiments", "%_of_negative_sentiments",
+              "%_of_mixed_sentiments", "%_of_neutral_sentiments"]
+
+# Default Streamlit plotly_chart width; more points per trace than pixels are invisible.
+CHART_WIDTH_PX = 700
+WEBGL_POINT_THRESHOLD = 5000
+
+
+def stringency_figure(df_filtered):
+    fig1 = make_subplots(rows=1, cols=1)
+    fig1.add_scatter(
+        x=df_filtered["date"], y=df_filtered["stringency_index"], mode='lines', name="stringency_index")
+    for sentiment in SENTIMENTS:
+        fig1.add_scatter(x=df_filtered["date"], y=df_filtered[sentiment],
+                         mode='lines', name=sentiment)
+
+    fig1.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Values",
+        title="<b>Chart 1: Stringency Index vs Time & Percentage of Sentiments vs Time</b>",
+        font=dict(
+            size=13
+        )
+    )
+    return fig1
+
+
+def reproduction_figure(df_filtered):
+    fig2 = make_subplots(rows=1, cols=1)
+    fig2.add_scatter(
+        x=df_filtered["date"], y=df_filtered["reproduction_rate"], mode='lines', name="reproduction_rate")
+    for sentiment in SENTIMENTS:
+        fig2.add_scatter(x=df_filtered["date"], y=df_filtered[sentiment] / 100,
+                         mode='lines', name=sentiment.replace("%_of_", "proportion_of_"))
+
+    fig2.update_layout(
+        title="<b>Chart 2: Reproduction Rate vs Time & Proportions of Sentiments vs Time</b>",
+        xaxis_title="Date",
+        yaxis_title="Values",
+        font=dict(
+            size=13
+        )
+    )
+    return fig2
+
+
+def lttb(x, y, n_out):
+    """Indices of the ``n_out`` points kept by Largest-Triangle-Three-Buckets.
+
+    ``y`` may be 2-D (one row per trace sharing ``x``), in which case all rows
+    are downsampled in the same pass and a row of indices is returned for each.
+    NaN points only win a bucket when the whole bucket is NaN, so gaps in the
+    data stay visible as gaps.
+    """
+    rows = np.atleast_2d(y)
+    k, n = rows.shape
+    if n_out >= n or n_out < 3:
+        keep = np.broadcast_to(np.arange(n), (k, n))
+        return keep if np.ndim(y) == 2 else keep[0]
+
+    # First and last points are always kept; the rest are split into n_out - 2 buckets.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty((k, n_out), dtype=np.int64)
+    keep[:, 0] = 0
+    keep[:, -1] = n - 1
+    trace = np.arange(k)
+    ax = np.full(k, x[0])
+    ay = rows[:, 0]
+    present = ~np.isnan(rows)
+    filled = np.where(present, rows, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i in range(n_out - 2):
+            lo, hi = edges[i], edges[i + 1]
+            # The next bucket's mean stands in for the (not yet chosen) next point.
+            next_hi = edges[i + 2] if i + 2 < len(edges) else n
+            next_x = x[hi:next_hi].mean()
+            next_y = filled[:, hi:next_hi].sum(axis=1) / present[:, hi:next_hi].sum(axis=1)
+            area = np.abs((ax - next_x)[:, None] * (rows[:, lo:hi] - ay[:, None])
+                          - (ax[:, None] - x[lo:hi]) * (next_y - ay)[:, None])
+            # Beside a gap the triangle has a missing corner: rank points by their
+            # distance from the corner that is known, so extremes are still kept.
+            known = np.where(np.isnan(ay), next_y, ay)
+            distance = np.abs(rows[:, lo:hi] - known[:, None])
+            area = np.where((np.isnan(ay) | np.isnan(next_y))[:, None], distance, area)
+            selected = lo + np.argmax(np.nan_to_num(area, nan=-1.0), axis=1)
+            keep[:, i + 1] = selected
+            # An all-NaN bucket keeps the previous anchor.
+            chosen = rows[trace, selected]
+            anchored = ~np.isnan(chosen)
+            ax = np.where(anchored, x[selected], ax)
+            ay = np.where(anchored, chosen, ay)
+    return keep if np.ndim(y) == 2 else keep[0]
+
+
+def multi_country_figure(index, countries, start_date, end_date,
+                         metrics=MULTI_COUNTRY_METRICS, max_points=CHART_WIDTH_PX,
+                         webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """Build the multi-country chart.
+
+    Returns ``(fig, points_sent, points_total)`` so the page can report how
+    much downsampling was applied.
+    """
+    # Countries covering the same days share x values, so their traces are
+    # downsampled together in one LTTB pass.
+    groups = {}
+    names = []
+    points_total = 0
+    for country in countries:
+        with span("filter", country=country) as filtering:
+            rows = index.rows(country, start_date, end_date)
+            filtering.tag(rows=rows.stop - rows.start)
+        days = index.days[rows]
+        group = groups.setdefault(days.tobytes(), (days, [], []))
+        for metric in metrics:
+            group[1].append(len(names))
+            group[2].append(index.arrays[metric][rows])
+            names.append("{}-{}".format(country, metric))
+        points_total += len(days) * len(metrics)
+
+    series = [None] * len(names)
+    for days, positions, values in groups.values():
+        values = np.vstack(values)
+        if len(days) > max_points:
+            keep = lttb(days.astype(np.float64), values, max_points)
+            days = days[keep]
+            values = np.take_along_axis(values, keep, axis=1)
+        else:
+            days = np.broadcast_to(days, values.shape)
+        for position, trace_days, trace_values in zip(positions, days, values):
+            series[position] = (names[position], trace_days, trace_values)
+
+    points_sent = sum(len(values) for _, _, values in series)
+    trace_type = "scattergl" if points_sent > webgl_threshold else "scatter"
+    traces = [
+        {"type": trace_type, "mode": "lines", "name": name,
+         "x": days.astype("datetime64[D]"), "y": values}
+        for name, days, values in series
+    ]
+    return go.Figure(data=traces), points_sent, points_total
+
+
+def rolling_correlation_figure(rolling_index, location, driver, sentiment, windows):
+    """Correlation over time from the precomputed ``rolling_correlations`` file.
+
+    One panel per method, one line per window length, read straight from the
+    mapped columns of ``rolling_index``.
+    """
+    start, stop = rolling_index.bounds.get(location, (0, 0))
+    dates = rolling_index.days[start:stop].astype("datetime64[D]")
+    fig = make_subplots(rows=len(METHODS), cols=1, shared_xaxes=True,
+                        subplot_titles=METHODS, vertical_spacing=0.06)
+    for row, method in enumerate(METHODS, start=1):
+        for window in windows:
+            fig.add_scatter(
+                x=dates, y=rolling_index.arrays[column_name(driver, sentiment, method, window)][start:stop],
+                mode='lines', name="{}-day window".format(window), legendgroup=str(window),
+                showlegend=row == 1, row=row, col=1)
+        fig.update_yaxes(range=[-1, 1], row=row, col=1)
+
+    fig.update_layout(
+        title="<b>Rolling correlation: {} vs {}</b>".format(driver, sentiment),
+        height=750,
+        font=dict(
+            size=13
+        )
+    )
+    fig.update_xaxes(title_text="Date", row=len(METHODS), col=1)
+    return fig
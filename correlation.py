@@ -0,0 +1,106 @@
+"""Pearson, Kendall and Spearman correlations for the driver/sentiment pairs shown.
+
+``DataFrame.corr`` computes the full all-columns matrix for every method (and
+Kendall pairwise in O(n^2)), only for the dashboard to read a handful of cells.
+Here only the requested (driver, sentiment) pairs are computed: both series
+are ranked once, Spearman is Pearson over the average ranks, and Kendall's
+tau-b goes through ``scipy.stats.kendalltau`` (Knight's algorithm, O(n log n)).
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from instrumentation import span
+
+DRIVERS = ["stringency_index", "reproduction_rate"]
+SENTIMENTS = ["%_of_positive_sentiments", "%_of_negative_sentiments",
+              "%_of_neutral_sentiments", "%_of_mixed_sentiments"]
+METHODS = ["Pearson", "Kendall", "Spearman"]
+
+
+def dense_rank(x):
+    """0-based dense ranks: equal values share a rank and ranks have no gaps."""
+    order = np.argsort(x, kind="stable")
+    ordered = x[order]
+    ranks = np.empty(len(x), dtype=np.int64)
+    ranks[order] = np.cumsum(np.r_[True, ordered[1:] != ordered[:-1]]) - 1
+    return ranks
+
+
+def average_rank(dense):
+    """1-based average ranks (as used by Spearman) from dense ranks."""
+    counts = np.bincount(dense)
+    return (np.cumsum(counts) - (counts - 1) / 2.0)[dense]
+
+
+def pearson(x, y):
+    # Undefined for a constant series; the arithmetic below would return noise.
+    if len(x) < 2 or np.ptp(x) == 0 or np.ptp(y) == 0:
+        return np.nan
+    dx = x - x.mean()
+    dy = y - y.mean()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(np.dot(dx, dy) / np.sqrt(np.dot(dx, dx) * np.dot(dy, dy)))
+
+
+def kendall_tau(rank_x, rank_y):
+    """Kendall's tau-b from dense ranks, via scipy's O(n log n) implementation of Knight's algorithm."""
+    # Undefined for a constant series; checked here so scipy doesn't warn.
+    if len(rank_x) < 2 or not rank_x.any() or not rank_y.any():
+        return np.nan
+    return float(stats.kendalltau(rank_x, rank_y).statistic)
+
+
+def _drop_missing(x, y):
+    valid = ~(np.isnan(x) | np.isnan(y))
+    return np.asarray(x[valid], dtype=np.float64), np.asarray(y[valid], dtype=np.float64)
+
+
+class CorrelationEngine:
+    """Memoised correlation tables per (location, start_date, end_date).
+
+    With ``range_stats`` (a ``range_stats.RangeStats``) Pearson is read from its
+    prefix sums instead of being recomputed from the rows.
+    """
+
+    def __init__(self, index, drivers=DRIVERS, sentiments=SENTIMENTS, maxsize=1024,
+                 range_stats=None):
+        self.index = index
+        self.range_stats = range_stats
+        self.drivers = drivers
+        self.sentiments = sentiments
+        self.tables = lru_cache(maxsize=maxsize)(self._tables)
+
+    def _tables(self, location, start_date, end_date):
+        rows = self.index.rows(location, start_date, end_date)
+        columns = {name: self.index.arrays[name][rows]
+                   for name in self.drivers + self.sentiments}
+        pairs = [(driver, sentiment) for driver in self.drivers for sentiment in self.sentiments]
+
+        with span("corr_rank", rows=rows.stop - rows.start):
+            ranked = {}
+            for driver, sentiment in pairs:
+                x, y = _drop_missing(columns[driver], columns[sentiment])
+                ranked[driver, sentiment] = (x, y, dense_rank(x), dense_rank(y))
+        with span("corr_pearson", rows=rows.stop - rows.start):
+            if self.range_stats is None:
+                pearsons = {pair: pearson(x, y) for pair, (x, y, _, _) in ranked.items()}
+            else:
+                pearsons = {pair: self.range_stats.pearson(location, *pair, start_date, end_date)
+                            for pair in pairs}
+        with span("corr_kendall", rows=rows.stop - rows.start):
+            kendalls = {pair: kendall_tau(rank_x, rank_y)
+                        for pair, (_, _, rank_x, rank_y) in ranked.items()}
+        with span("corr_spearman", rows=rows.stop - rows.start):
+            spearmans = {pair: pearson(average_rank(rank_x), average_rank(rank_y))
+                         for pair, (_, _, rank_x, rank_y) in ranked.items()}
+
+        return {
+            driver: pd.DataFrame(
+                [[pearsons[driver, sentiment], kendalls[driver, sentiment],
+                  spearmans[driver, sentiment]] for sentiment in self.sentiments],
+                index=self.sentiments, columns=METHODS)
+            for driver in self.drivers
+        }
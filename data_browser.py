@@ -0,0 +1,126 @@
+"""Paginated raw-data viewer.
+
+Only the requested page is sliced out of the shared, sorted dataset and sent
+to the browser. Location and date filters resolve to contiguous row ranges through
+the location index, and downloads are generated on click, chunk by chunk, from
+those ranges rather than from a filtered copy of the whole frame.
+"""
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+from instrumentation import span
+
+PAGE_SIZES = [25, 50, 100, 500]
+DOWNLOAD_CHUNK_ROWS = 50_000
+
+
+def filtered_slices(index, locations, start_date, end_date):
+    """Row ranges of the selected locations within the date range, in sort order."""
+    locations = set(locations) if locations else set(index.bounds)
+    return [index.rows(location, start_date, end_date)
+            for location in index.bounds if location in locations]
+
+
+def _chunks(index, slices, columns, chunk_rows):
+    for rows in slices:
+        for start in range(rows.start, rows.stop, chunk_rows):
+            yield index.take(slice(start, min(start + chunk_rows, rows.stop)), columns)
+
+
+def page_frame(index, slices, columns, page, page_size):
+    """Rows ``[page * page_size, (page + 1) * page_size)`` of the filtered data."""
+    skip = page * page_size
+    remaining = page_size
+    parts = []
+    for rows in slices:
+        size = rows.stop - rows.start
+        if skip >= size:
+            skip -= size
+            continue
+        start = rows.start + skip
+        take = min(size - skip, remaining)
+        parts.append(index.take(slice(start, start + take), columns))
+        skip = 0
+        remaining -= take
+        if not remaining:
+            break
+    if not parts:
+        return index.take(slice(0, 0), columns)
+    return pd.concat(parts, ignore_index=True)
+
+
+def write_csv(index, slices, columns, chunk_rows=DOWNLOAD_CHUNK_ROWS):
+    """CSV of the filtered rows, as a buffer rewound for ``st.download_button`` to read."""
+    buffer = io.StringIO()
+    header = True
+    for chunk in _chunks(index, slices, columns, chunk_rows):
+        chunk.to_csv(buffer, header=header, index=False)
+        header = False
+    if header:
+        index.take(slice(0, 0), columns).to_csv(buffer, index=False)
+    # Handing over the buffer itself avoids a second full copy from getvalue().
+    buffer.seek(0)
+    return buffer
+
+
+def write_parquet(index, slices, columns, chunk_rows=DOWNLOAD_CHUNK_ROWS):
+    """Parquet file of the filtered rows, as a buffer rewound like ``write_csv``'s."""
+    buffer = io.BytesIO()
+    writer = None
+    for chunk in _chunks(index, slices, columns, chunk_rows):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            # Types are taken from real rows: an empty object column infers as null.
+            writer = pq.ParquetWriter(buffer, table.schema)
+        writer.write_table(table.cast(writer.schema))
+    if writer is None:
+        empty = index.take(slice(0, 0), columns)
+        pq.write_table(pa.Table.from_pandas(empty, preserve_index=False), buffer)
+    else:
+        writer.close()
+    buffer.seek(0)
+    return buffer
+
+
+def raw_data_browser(index, key):
+    """Render the raw-data viewer; ``key`` keeps widget ids unique per page."""
+    if not st.checkbox("Browse the raw data", key=key + "-load"):
+        return
+
+    columns = st.multiselect("Columns:", index.columns, default=index.columns,
+                             key=key + "-columns")
+    locations = st.multiselect("Countries/areas (all if none selected):", index.locations,
+                               key=key + "-locations")
+    date_range = st.date_input("Date range:", value=(index.min_date, index.max_date),
+                               min_value=index.min_date, max_value=index.max_date,
+                               key=key + "-dates")
+    if len(date_range) != 2 or not columns:
+        st.info("🛈 Select a start date, an end date and at least one column to see the data.")
+        return
+
+    slices = filtered_slices(index, locations, *date_range)
+    total = sum(rows.stop - rows.start for rows in slices)
+    page_size = st.selectbox("Rows per page:", PAGE_SIZES, key=key + "-page-size")
+    pages = max(1, -(-total // page_size))
+    page = st.number_input("Page:", min_value=1, max_value=pages, value=1,
+                           key=key + "-page") - 1
+
+    frame = page_frame(index, slices, columns, page, page_size)
+    with span("st_dataframe", rows=len(frame)):
+        st.dataframe(data=frame)
+    st.caption("Rows {:,}-{:,} of {:,}".format(
+        min(page * page_size + 1, total), min((page + 1) * page_size, total), total))
+
+    csv_column, parquet_column = st.columns(2)
+    with csv_column:
+        st.download_button("Download CSV", lambda: write_csv(index, slices, columns),
+                           file_name="covid_sentiments.csv", mime="text/csv",
+                           key=key + "-csv")
+    with parquet_column:
+        st.download_button("Download Parquet", lambda: write_parquet(index, slices, columns),
+                           file_name="covid_sentiments.parquet",
+                           mime="application/octet-stream", key=key + "-parquet")
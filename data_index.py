@@ -0,0 +1,102 @@
+"""(location, date) index over the compact, sorted dashboard dataset.
+
+The dataset is sorted by location and date, so each location occupies one
+contiguous block of rows. A lookup is a dict hit for the block followed by a
+binary search over integer day numbers, and returns row slices rather than
+boolean masks.
+
+All arrays are zero-copy numpy views of the memory-mapped Arrow table built by
+``data_store``: locations as dictionary codes, dates as int32 days since the
+epoch and metrics as float32 with NaN for missing values. Only the rows a view
+asks for are ever materialised as a DataFrame.
+"""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+EPOCH = dt.date(1970, 1, 1)
+
+
+def to_day(date):
+    """Day number of a ``datetime.date`` (days since 1970-01-01)."""
+    return (date - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + dt.timedelta(days=int(day))
+
+
+def _single_chunk(column):
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+def numpy_column(table, name):
+    """Zero-copy numpy view of a null-free numeric column of ``table``."""
+    return _single_chunk(table.column(name)).to_numpy(zero_copy_only=True)
+
+
+class LocationIndex:
+
+    def __init__(self, table):
+        location = _single_chunk(table.column("location"))
+        self.codes = location.indices.to_numpy(zero_copy_only=True)
+        self.location_names = np.array(location.dictionary.to_pylist(), dtype=object)
+        self.days = _single_chunk(table.column("date")).view(pa.int32()).to_numpy(zero_copy_only=True)
+        self.columns = table.column_names
+        self.metrics = [name for name in self.columns if name not in ("location", "date")]
+        self.arrays = {name: numpy_column(table, name) for name in self.metrics}
+
+        self.bounds = {}
+        if len(self.codes):
+            starts = np.flatnonzero(np.r_[True, self.codes[1:] != self.codes[:-1]])
+            stops = np.r_[starts[1:], len(self.codes)]
+            self.bounds = {self.location_names[self.codes[start]]: (int(start), int(stop))
+                           for start, stop in zip(starts, stops)}
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def locations(self):
+        return list(self.bounds)
+
+    @property
+    def min_date(self):
+        return from_day(self.days.min())
+
+    @property
+    def max_date(self):
+        return from_day(self.days.max())
+
+    def rows(self, location, start_date, end_date):
+        """Row slice of ``location`` between ``start_date`` and ``end_date`` inclusive.
+
+        A reversed date range gives an empty slice rather than one with ``stop < start``.
+        """
+        start, stop = self.bounds.get(location, (0, 0))
+        days = self.days[start:stop]
+        lo = np.searchsorted(days, to_day(start_date), side="left")
+        hi = max(np.searchsorted(days, to_day(end_date), side="right"), lo)
+        return slice(start + int(lo), start + int(hi))
+
+    def take(self, rows, columns=None):
+        """DataFrame of the given row slice, with ``datetime.date`` dates."""
+        data = {}
+        for name in columns or self.columns:
+            if name == "location":
+                data[name] = self.location_names[self.codes[rows]]
+            elif name == "date":
+                data[name] = self.days[rows].astype("datetime64[D]").astype(object)
+            else:
+                data[name] = self.arrays[name][rows]
+        return pd.DataFrame(data, columns=list(data))
+
+    def frame(self, location, start_date, end_date):
+        """Rows of ``location`` in the date range."""
+        return self.take(self.rows(location, start_date, end_date))
+
+    def column(self, location, name, start_date, end_date):
+        """Values of one metric in the date range, as a view of the shared array."""
+        return self.arrays[name][self.rows(location, start_date, end_date)]
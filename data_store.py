@@ -0,0 +1,247 @@
+"""Columnar on-disk cache of the aggregated Spark output.
+
+The dashboard used to parse the Spark CSV on every Streamlit rerun. Instead each
+``part-*.csv`` partition in the Spark output directory is converted once into an
+Arrow IPC file, and the partitions are merged into one sorted, memory-mapped
+dataset file. A partition is only re-parsed when it changes (by mtime/size,
+confirmed by hash); new partitions are parsed in parallel and merged with the
+already converted ones.
+
+The merged file is stored compactly (dictionary-encoded locations, int32 day
+numbers, float32 metrics with NaN for missing values) and written once under a
+file lock, so every session and every server process maps the same pages
+instead of holding its own copy of the frame. Large structures derived from the
+dataset (see ``load_derived``) are cached and shared the same way.
+"""
+import contextlib
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.ipc as ipc
+
+from instrumentation import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent first builds just race on os.replace.
+    fcntl = None
+
+CACHE_DIR = ".cache"
+PARTITION_PATTERN = "part-*.csv"
+DATASET_FILE = "dataset.arrow"
+# Bump when the layout of DATASET_FILE changes so existing caches are rebuilt.
+DATASET_FORMAT = 2
+FINGERPRINT_KEY = b"source_fingerprint"
+
+CSV_NULL_VALUES = ["", "-"]
+CSV_DATE_FORMAT = "%d/%m/%Y"
+
+
+def discover_partitions(data_dir):
+    return sorted(glob.glob(os.path.join(data_dir, PARTITION_PATTERN)))
+
+
+def source_version(data_dir):
+    """Cheap stat-based token that changes whenever a partition is added, removed or modified."""
+    version = []
+    for path in discover_partitions(data_dir):
+        stat = os.stat(path)
+        version.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _partition_cache_path(csv_path, cache_dir):
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, "partitions", name + ".arrow")
+
+
+def read_csv(csv_path):
+    """Parse one Spark output partition into an Arrow table."""
+    table = pv.read_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            column_types={"location": pa.string(), "date": pa.timestamp("s")},
+            timestamp_parsers=[CSV_DATE_FORMAT],
+            null_values=CSV_NULL_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+    # Cast every metric explicitly so a partition whose column happens to be
+    # entirely empty still concatenates with the others.
+    schema = pa.schema([
+        pa.field(name, pa.string() if name == "location"
+                 else pa.date32() if name == "date" else pa.float64())
+        for name in table.column_names
+    ])
+    return table.cast(schema)
+
+
+def read_fingerprint(arrow_path):
+    """Fingerprint stored by ``write_table``, or None if the file is missing or unreadable."""
+    try:
+        with pa.memory_map(arrow_path) as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    raw = metadata.get(FINGERPRINT_KEY)
+    return json.loads(raw) if raw else None
+
+
+def write_table(table, arrow_path, fingerprint):
+    """Atomically write ``table`` as an Arrow IPC file stamped with ``fingerprint``."""
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINT_KEY] = json.dumps(fingerprint).encode()
+    table = table.replace_schema_metadata(metadata)
+    tmp_path = "{}.{}.tmp".format(arrow_path, os.getpid())
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, arrow_path)
+
+
+def map_table(arrow_path):
+    """Memory-map an Arrow IPC file: columns are views of the page cache, not copies."""
+    return ipc.open_file(pa.memory_map(arrow_path)).read_all()
+
+
+def _current_fingerprint(csv_path, arrow_path):
+    """Fingerprint of the converted partition if it still matches ``csv_path``, else None."""
+    cached = read_fingerprint(arrow_path)
+    if cached is None:
+        return None
+    stat = os.stat(csv_path)
+    if cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return cached
+    # Touched (e.g. re-copied) but not modified: the hash decides, and the new
+    # stat is recorded so later loads don't hash the file again.
+    if cached["sha256"] != _file_hash(csv_path):
+        return None
+    fingerprint = dict(cached, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    write_table(map_table(arrow_path), arrow_path, fingerprint)
+    return fingerprint
+
+
+def _convert_partition(csv_path, cache_dir):
+    """Worker: parse one partition and write its Arrow file, returning the fingerprint."""
+    stat = os.stat(csv_path)
+    fingerprint = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                   "sha256": _file_hash(csv_path)}
+    write_table(read_csv(csv_path), _partition_cache_path(csv_path, cache_dir), fingerprint)
+    return fingerprint
+
+
+def _sync_partitions(partitions, cache_dir, max_workers):
+    """Convert new or modified partitions, returning the manifest ``{name: sha256}``."""
+    manifest = {}
+    stale = []
+    for csv_path in partitions:
+        cached = _current_fingerprint(csv_path, _partition_cache_path(csv_path, cache_dir))
+        if cached is not None:
+            manifest[os.path.basename(csv_path)] = cached["sha256"]
+        else:
+            stale.append(csv_path)
+
+    if len(stale) == 1:
+        with span("csv_load", partitions=1):
+            fingerprints = [_convert_partition(stale[0], cache_dir)]
+    elif stale:
+        # Spawned, not forked: this runs inside Streamlit's threaded server, and
+        # forking a process with other threads running can deadlock the child.
+        with span("csv_load", partitions=len(stale)), \
+                ProcessPoolExecutor(max_workers=max_workers,
+                                    mp_context=multiprocessing.get_context("spawn")) as pool:
+            fingerprints = list(pool.map(_convert_partition, stale,
+                                         [cache_dir] * len(stale)))
+    else:
+        fingerprints = []
+    for csv_path, fingerprint in zip(stale, fingerprints):
+        manifest[os.path.basename(csv_path)] = fingerprint["sha256"]
+    return manifest
+
+
+def compact(table):
+    """Sort by location and date and convert to the compact in-memory layout."""
+    table = table.sort_by([("location", "ascending"), ("date", "ascending")])
+    columns = []
+    for name in table.column_names:
+        column = table.column(name)
+        if name == "location":
+            column = pc.dictionary_encode(column.combine_chunks())
+        elif name != "date":
+            column = pc.fill_null(column.cast(pa.float32()), float("nan"))
+        columns.append(column)
+    # One contiguous chunk per column, so readers get plain numpy views.
+    return pa.table(columns, names=table.column_names).combine_chunks()
+
+
+@contextlib.contextmanager
+def _build_lock(cache_dir):
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_table(data_dir, cache_dir=CACHE_DIR, max_workers=None):
+    """Return the memory-mapped, compact Arrow table of every partition in ``data_dir``."""
+    partitions = discover_partitions(data_dir)
+    if not partitions:
+        raise FileNotFoundError("No {} files found in {!r}".format(PARTITION_PATTERN, data_dir))
+    os.makedirs(os.path.join(cache_dir, "partitions"), exist_ok=True)
+
+    dataset_path = os.path.join(cache_dir, DATASET_FILE)
+    # Server processes starting together build the file once; the others wait
+    # and then map what the first one wrote.
+    with _build_lock(cache_dir):
+        manifest = {"format": DATASET_FORMAT,
+                    "partitions": _sync_partitions(partitions, cache_dir, max_workers)}
+        if read_fingerprint(dataset_path) != manifest:
+            # Only the merge is redone here: every partition is already converted
+            # and mapped, and concat_tables just chains their buffers.
+            with span("merge_sort", partitions=len(partitions)) as merge:
+                merged = pa.concat_tables(
+                    [map_table(_partition_cache_path(p, cache_dir)) for p in partitions])
+                merge.tag(rows=merged.num_rows)
+                write_table(compact(merged.replace_schema_metadata(None)), dataset_path, manifest)
+    return map_table(dataset_path)
+
+
+def dataset_fingerprint(table):
+    """Fingerprint of the source partitions a table returned by ``load_table`` was built from."""
+    return json.loads(table.schema.metadata[FINGERPRINT_KEY])
+
+
+def load_derived(dataset, file_name, build, layout, cache_dir=CACHE_DIR):
+    """Map the Arrow file ``file_name`` derived from ``dataset``, building it with ``build()`` if needed.
+
+    Like the dataset, the file is written once under the build lock and stamped
+    with the dataset's fingerprint, so server processes share its pages and a
+    file computed from other data is rebuilt. ``layout`` (any JSON value, e.g. a
+    format number and the column names) is stamped alongside it, so a file
+    written by code with a different layout is rebuilt too.
+    """
+    path = os.path.join(cache_dir, file_name)
+    fingerprint = {"layout": layout, "dataset": dataset_fingerprint(dataset)}
+    with _build_lock(cache_dir):
+        if read_fingerprint(path) != fingerprint:
+            write_table(build(), path, fingerprint)
+    return map_table(path)
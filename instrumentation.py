@@ -0,0 +1,166 @@
+"""Timing spans for the dashboard's hot path.
+
+Set ``DASHBOARD_PROFILE=1`` to enable. Each Streamlit rerun collects its spans
+(stage name, duration and tags such as page, selected countries and row count)
+in a thread-local list; at the end of the rerun they are appended as JSON lines
+to ``spans.jsonl`` and folded into per-stage totals that are rewritten to a
+Prometheus text file (one per server process, for a textfile collector or any
+local scraper). When disabled, ``span`` hands back a shared no-op object, so
+instrumented code pays a single function call.
+"""
+import json
+import os
+import threading
+import time
+
+PROFILE_ENV = "DASHBOARD_PROFILE"
+PROFILE_DIR_ENV = "DASHBOARD_PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "profile"
+SPANS_FILE = "spans.jsonl"
+METRIC_PREFIX = "dashboard"
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def tag(self, **tags):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, tracer, name, tags):
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, time.perf_counter() - self.start, self.tags)
+        return False
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+
+def _labels(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for key, value in sorted(labels.items()))
+
+
+class Tracer:
+
+    def __init__(self, enabled=False, profile_dir=DEFAULT_PROFILE_DIR):
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.gauges = {}
+        self.counters = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.environ.get(PROFILE_ENV) == "1",
+                   profile_dir=os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR))
+
+    def span(self, name, **tags):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, tags)
+
+    def begin(self, **tags):
+        """Start collecting the spans of one rerun on this thread."""
+        if self.enabled:
+            self.local.spans = []
+            self.local.tags = dict(tags)
+
+    def tag(self, **tags):
+        """Tag every span of the current rerun (e.g. with the page once known)."""
+        if self.enabled and getattr(self.local, "tags", None) is not None:
+            self.local.tags.update(tags)
+
+    def gauge(self, name, value):
+        if self.enabled:
+            with self.lock:
+                self.gauges[name] = value
+
+    def counter(self, name, total):
+        """Export ``total``, a count that only grows, as the counter ``<name>_total``."""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = total
+
+    def spans(self):
+        """Spans recorded so far in the current rerun, rerun tags applied."""
+        if not self.enabled:
+            return []
+        tags = getattr(self.local, "tags", None) or {}
+        return [dict(tags, **span) for span in getattr(self.local, "spans", None) or []]
+
+    def end(self):
+        """Flush the current rerun's spans to the JSON lines and Prometheus files."""
+        if not self.enabled:
+            return
+        spans = self.spans()
+        self.local.spans = None
+        self.local.tags = None
+        self._flush(spans)
+
+    def _record(self, name, seconds, tags):
+        span = dict(tags, stage=name, seconds=seconds, timestamp=time.time())
+        spans = getattr(self.local, "spans", None)
+        if spans is None:
+            # Outside a rerun (e.g. a command-line run): write it straight away.
+            self._flush([span])
+        else:
+            spans.append(span)
+
+    def _flush(self, spans):
+        if not spans:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with self.lock:
+            for span in spans:
+                key = (span["stage"], span.get("page", ""))
+                count, total = self.totals.get(key, (0, 0.0))
+                self.totals[key] = (count + 1, total + span["seconds"])
+            with open(os.path.join(self.profile_dir, SPANS_FILE), "a") as f:
+                f.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+            self._write_metrics()
+
+    def _write_metrics(self):
+        name = "{}_stage_seconds".format(METRIC_PREFIX)
+        lines = ["# HELP {} Time spent in each dashboard stage.".format(name),
+                 "# TYPE {} summary".format(name)]
+        for (stage, page), (count, total) in sorted(self.totals.items()):
+            labels = _labels({"stage": stage, "page": page})
+            lines.append("{}_sum{{{}}} {!r}".format(name, labels, total))
+            lines.append("{}_count{{{}}} {}".format(name, labels, count))
+        for gauge, value in sorted(self.gauges.items()):
+            lines.append("# TYPE {}_{} gauge".format(METRIC_PREFIX, gauge))
+            lines.append("{}_{} {!r}".format(METRIC_PREFIX, gauge, value))
+        for counter, total in sorted(self.counters.items()):
+            lines.append("# TYPE {}_{}_total counter".format(METRIC_PREFIX, counter))
+            lines.append("{}_{}_total {!r}".format(METRIC_PREFIX, counter, total))
+
+        # One file per server process; written atomically so a scrape never sees half of it.
+        path = os.path.join(self.profile_dir, "{}-{}.prom".format(METRIC_PREFIX, os.getpid()))
+        with open(path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+tracer = Tracer.from_env()
+span = tracer.span
@@ -0,0 +1,198 @@
+"""Constant-time statistics over any (location, date window).
+
+Each location occupies a contiguous block of the sorted dataset, and every
+column gets a cumulative sum that restarts at each block, so a window sum is
+the difference of two entries. Pearson correlation uses masked cumulative sums
+of x, y, x^2, y^2 and xy per driver/sentiment pair (a row counts only when both
+values are present) and means use per-column sums and counts. Minima/maxima
+come from per-block extremes of the source float32 values plus a scan of the
+partial blocks at either end. NaN gaps (e.g. Hong Kong's reproduction_rate or
+the empty weekly_icu_admissions_per_million cells) are excluded rather than
+propagated.
+
+The cumulative sums are row-aligned float64 arrays, several times the size of
+the dataset. They are written to the dataset cache and memory-mapped rather
+than held privately by each server process.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import data_store
+from correlation import DRIVERS, SENTIMENTS
+from data_index import numpy_column
+
+SUMMARY_COLUMNS = ["count", "mean", "min", "max"]
+RANGE_STATS_FILE = "range_stats.arrow"
+# Bump when ``cumulative_sums`` changes the columns it writes so cached files are rebuilt.
+RANGE_STATS_FORMAT = 1
+# Cumulative sums kept per driver/sentiment pair: row count, x, y, x^2, y^2 and xy.
+PAIR_SUMS = ["n", "x", "y", "xx", "yy", "xy"]
+# Rows per block of precomputed extremes: a query scans at most two partial blocks.
+EXTREME_BLOCK_ROWS = 64
+
+
+def _local_cumsum(values, bounds, dtype=np.float64):
+    out = np.empty(len(values), dtype=dtype)
+    for start, stop in bounds:
+        np.cumsum(values[start:stop], out=out[start:stop])
+    return out
+
+
+def _window_sum(cumsum, block_start, rows):
+    # A reversed date range is an empty window, not a negative one.
+    if rows.stop <= rows.start:
+        return 0.0
+    before = cumsum[rows.start - 1] if rows.start > block_start else 0.0
+    return cumsum[rows.stop - 1] - before
+
+
+def _block_extremes(values, reduce):
+    """``reduce`` (``np.fmin``/``np.fmax``, which skip NaN) of every block of rows."""
+    if not len(values):
+        return values[:0]
+    return reduce.reduceat(values, np.arange(0, len(values), EXTREME_BLOCK_ROWS))
+
+
+def _extreme(values, blocks, start, stop, reduce):
+    """``reduce`` of ``values[start:stop]``, reading whole blocks from ``blocks``."""
+    first = -(-start // EXTREME_BLOCK_ROWS)
+    last = stop // EXTREME_BLOCK_ROWS
+    if first >= last:
+        return reduce.reduce(values[start:stop])
+    return reduce.reduce(np.concatenate([values[start:first * EXTREME_BLOCK_ROWS],
+                                         blocks[first:last],
+                                         values[last * EXTREME_BLOCK_ROWS:stop]]))
+
+
+def _location_means(index, name):
+    """Mean of ``name`` over each location's block, 0 where it has no values."""
+    starts = np.array([start for start, _ in index.bounds.values()], dtype=np.int64)
+    values = index.arrays[name]
+    present = ~np.isnan(values)
+    means = np.zeros(len(starts))
+    if len(starts):
+        sums = np.add.reduceat(np.where(present, values, 0.0), starts)
+        counts = np.add.reduceat(present, starts)
+        np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+
+def _pair_column(driver, sentiment, part):
+    return "pair:{}:{}:{}".format(driver, sentiment, part)
+
+
+def cumulative_sums(index, drivers=DRIVERS, sentiments=SENTIMENTS, columns=None):
+    """Arrow table of the per-location cumulative sums, aligned row for row with ``index``.
+
+    Values are shifted by their location's mean before summing, which keeps
+    the sums small and the variance differences well conditioned. The shifted
+    copies only live while the table is built.
+    """
+    columns = columns or index.metrics
+    bounds = list(index.bounds.values())
+    lengths = np.array([stop - start for start, stop in bounds], dtype=np.int64)
+
+    def centered(name):
+        return index.arrays[name] - np.repeat(_location_means(index, name), lengths)
+
+    sums = {}
+    for name in columns:
+        values = centered(name)
+        present = ~np.isnan(values)
+        sums["count:" + name] = _local_cumsum(present, bounds, np.int32)
+        sums["total:" + name] = _local_cumsum(np.where(present, values, 0.0), bounds)
+    for driver in drivers:
+        x_all = centered(driver)
+        for sentiment in sentiments:
+            y = centered(sentiment)
+            present = ~(np.isnan(x_all) | np.isnan(y))
+            x = np.where(present, x_all, 0.0)
+            y = np.where(present, y, 0.0)
+            sums[_pair_column(driver, sentiment, "n")] = _local_cumsum(present, bounds, np.int32)
+            for part, values in zip(PAIR_SUMS[1:], (x, y, x * x, y * y, x * y)):
+                sums[_pair_column(driver, sentiment, part)] = _local_cumsum(values, bounds)
+    return pa.table({name: pa.array(values) for name, values in sums.items()})
+
+
+class RangeStats:
+    """Window statistics over ``index``.
+
+    ``sums`` is the table from ``cumulative_sums``; it is built in memory when
+    omitted. ``RangeStats.cached`` maps it from the dataset cache instead, so
+    every server process shares one copy.
+    """
+
+    def __init__(self, index, drivers=DRIVERS, sentiments=SENTIMENTS, columns=None, sums=None):
+        self.index = index
+        self.columns = columns or index.metrics
+        if sums is None:
+            sums = cumulative_sums(index, drivers, sentiments, self.columns)
+
+        self.block_number = {location: number for number, location in enumerate(index.bounds)}
+        self.means = {name: _location_means(index, name) for name in self.columns}
+        self.count = {name: numpy_column(sums, "count:" + name) for name in self.columns}
+        self.total = {name: numpy_column(sums, "total:" + name) for name in self.columns}
+        self.pairs = {(driver, sentiment): [numpy_column(sums, _pair_column(driver, sentiment, part))
+                                            for part in PAIR_SUMS]
+                      for driver in drivers for sentiment in sentiments}
+
+        # Extremes are exact in the source float32, and small enough to keep per process.
+        self.minimum = {}
+        self.maximum = {}
+        for name in set(self.columns) | set(drivers) | set(sentiments):
+            self.minimum[name] = _block_extremes(index.arrays[name], np.fmin)
+            self.maximum[name] = _block_extremes(index.arrays[name], np.fmax)
+
+    @classmethod
+    def cached(cls, index, dataset, cache_dir=data_store.CACHE_DIR):
+        """RangeStats over the default columns, with the sums mapped from ``cache_dir``."""
+        layout = {"format": RANGE_STATS_FORMAT, "drivers": DRIVERS, "sentiments": SENTIMENTS,
+                  "pair_sums": PAIR_SUMS}
+        sums = data_store.load_derived(dataset, RANGE_STATS_FILE,
+                                       lambda: cumulative_sums(index), layout, cache_dir)
+        return cls(index, sums=sums)
+
+    def _window(self, location, start_date, end_date):
+        rows = self.index.rows(location, start_date, end_date)
+        return self.index.bounds.get(location, (0, 0))[0], rows
+
+    def _min(self, name, rows):
+        return _extreme(self.index.arrays[name], self.minimum[name], rows.start, rows.stop, np.fmin)
+
+    def _max(self, name, rows):
+        return _extreme(self.index.arrays[name], self.maximum[name], rows.start, rows.stop, np.fmax)
+
+    def _is_constant(self, name, rows):
+        return self._min(name, rows) == self._max(name, rows)
+
+    def pearson(self, location, driver, sentiment, start_date, end_date):
+        block_start, rows = self._window(location, start_date, end_date)
+        n, sx, sy, sxx, syy, sxy = (_window_sum(c, block_start, rows)
+                                    for c in self.pairs[driver, sentiment])
+        if n < 2 or self._is_constant(driver, rows) or self._is_constant(sentiment, rows):
+            return np.nan
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        # Constant over the rows where both are present, but not over the window.
+        if var_x <= 1e-12 * sxx or var_y <= 1e-12 * syy:
+            return np.nan
+        return float((sxy - sx * sy / n) / np.sqrt(var_x * var_y))
+
+    def summary(self, location, start_date, end_date):
+        """Count, mean, min and max of every column over the window (NaN when it is empty)."""
+        block_start, rows = self._window(location, start_date, end_date)
+        data = []
+        for name in self.columns:
+            n = _window_sum(self.count[name], block_start, rows)
+            if n == 0:
+                data.append([0, np.nan, np.nan, np.nan])
+                continue
+            mean = (_window_sum(self.total[name], block_start, rows) / n
+                    + self.means[name][self.block_number[location]])
+            data.append([int(n), mean, self._min(name, rows), self._max(name, rows)])
+        summary = pd.DataFrame(data, index=self.columns, columns=SUMMARY_COLUMNS)
+        # The source is float32: show its shortest decimal form, not 87.239998.
+        for name in ("mean", "min", "max"):
+            summary[name] = [float(str(np.float32(value))) for value in summary[name]]
+        return summary
@@ -0,0 +1,75 @@
+"""Process-wide cache of computed dashboard artifacts.
+
+Sessions asking for the same view (e.g. "Singapore, last 14 days") share the
+rendered figure JSON and correlation tables instead of each recomputing them.
+Entries are charged by their pickled size against a byte budget and evicted
+least-recently-used first; the whole cache is dropped when the dataset version
+changes.
+"""
+import pickle
+import threading
+from collections import OrderedDict
+
+# Memory budget for figures and correlation tables shared across sessions.
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+
+class ResultCache:
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Streamlit runs each session's script in its own thread.
+        self.lock = threading.Lock()
+
+    def sync_version(self, version):
+        """Drop every entry if ``version`` differs from the one the entries were built on."""
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        # A concurrent miss on the same key computes twice; the later put wins.
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "bytes": self.bytes,
+                    "max_bytes": self.max_bytes}
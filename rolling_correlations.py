@@ -0,0 +1,217 @@
+"""Offline precompute of rolling-window correlations for every location.
+
+For each location, each (driver, sentiment) pair and each window length, the
+Pearson, Kendall and Spearman correlations over the trailing window of calendar
+days ending on every date are computed. Each value is the one the single-country
+page would show for that date range. Locations are spread across a process pool
+and every window of a location is computed at once: windows are at most a few
+weeks long, so the pairwise comparisons behind Kendall's tau-b and the average
+ranks behind Spearman are done as padded (date, window, window) array
+operations.
+
+The result is written next to the dataset cache in the dataset's own compact
+layout: one row per (location, date) in the same sort order, and one float32
+column per (driver, sentiment, method, window). The dashboard maps it and looks
+rows up through a ``LocationIndex``, so plotting correlation over time involves
+no computation per request.
+
+    python rolling_correlations.py --data . --windows 7 14 30
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+
+import data_store
+from correlation import DRIVERS, METHODS, SENTIMENTS
+from data_index import LocationIndex
+from instrumentation import span
+
+ROLLING_FILE = "rolling_correlations.arrow"
+WINDOWS = [7, 14, 30]
+CHUNK_WINDOWS = 128
+# Schema metadata listing the window lengths; the file is stamped with the
+# fingerprint of the dataset it was computed from by ``data_store.write_table``.
+WINDOWS_KEY = b"windows"
+
+
+def column_name(driver, sentiment, method, window):
+    return "{}:{}:{}:{}d".format(driver, sentiment, method, window)
+
+
+def _windowed(values, lo, ends, window):
+    """(len(ends), window) matrix of the rows in each trailing window, NaN-padded."""
+    positions = lo[:, None] + np.arange(window)
+    inside = positions <= ends[:, None]
+    matrix = values[np.minimum(positions, len(values) - 1)]
+    matrix[~inside] = np.nan
+    return matrix
+
+
+def _pearson_rows(x, y, valid):
+    """Row-wise Pearson over the valid cells (degenerate rows are masked by the caller)."""
+    count = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+    dx = np.where(valid, x - np.where(valid, x, 0).sum(axis=1, keepdims=True) / count, 0)
+    dy = np.where(valid, y - np.where(valid, y, 0).sum(axis=1, keepdims=True) / count, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (dx * dy).sum(axis=1) / np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1))
+
+
+def _pairwise(x):
+    """Signs of ``x[i] - x[j]`` within each row, with the ``>`` and ``==`` indicators
+    the ranks and tie counts are summed from."""
+    greater = (x[:, :, None] > x[:, None, :]).astype(np.float32)
+    less = greater.transpose(0, 2, 1)
+    # Cells with a missing value compare as equal here; the weights drop them.
+    return greater - less, greater, 1 - greater - less
+
+
+def _masked_sum(matrix, weights):
+    """Per row, ``matrix @ weights``: sums over the valid cells of each column."""
+    return np.matmul(matrix, weights[:, :, None])[:, :, 0]
+
+
+def _average_ranks(pairwise, weights):
+    """1-based average ranks within each row, over the valid cells only."""
+    _, greater, equal = pairwise
+    return _masked_sum(greater, weights) + (_masked_sum(equal, weights) + 1) / 2.0
+
+
+def _pairs(matrix, weights):
+    return (_masked_sum(matrix, weights) * weights).sum(axis=1, dtype=np.float64)
+
+
+def _correlations(x, y, pairwise_x, pairwise_y):
+    """Row-wise Pearson, Kendall's tau-b and Spearman over the cells where both are present.
+
+    Signs are antisymmetric, so sums over all ordered pairs are twice the sums
+    over ``i < j``; tie counts also include each cell paired with itself. A
+    window whose pairs are all tied in x or in y (fewer than two values, or a
+    constant series) has no correlation under any method.
+    """
+    valid = ~(np.isnan(x) | np.isnan(y))
+    weights = valid.astype(np.float32)
+    signs_x, _, equal_x = pairwise_x
+    signs_y, _, equal_y = pairwise_y
+    count = weights.sum(axis=1, dtype=np.float64)
+    total = count * (count - 1) / 2
+    x_ties = (_pairs(equal_x, weights) - count) / 2
+    y_ties = (_pairs(equal_y, weights) - count) / 2
+    denominator = np.sqrt((total - x_ties) * (total - y_ties))
+    degenerate = ~(denominator > 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kendall = _pairs(signs_x * signs_y, weights) / 2 / denominator
+    pearson = _pearson_rows(x, y, valid)
+    spearman = _pearson_rows(_average_ranks(pairwise_x, weights),
+                             _average_ranks(pairwise_y, weights), valid)
+    results = [pearson, kendall, spearman]
+    for values in results:
+        values[degenerate] = np.nan
+    return results
+
+
+def rolling_block(days, columns, windows, drivers=DRIVERS, sentiments=SENTIMENTS):
+    """Rolling correlations of one location, as ``{column_name: float32 array}``."""
+    columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+    results = {column_name(driver, sentiment, method, window): np.empty(len(days), np.float32)
+               for window in windows for driver in drivers for sentiment in sentiments
+               for method in METHODS}
+    for window in windows:
+        lo = np.searchsorted(days, days - (window - 1), side="left")
+        # Chunks of windows keep the (rows, window, window) temporaries small.
+        for first in range(0, len(days), CHUNK_WINDOWS):
+            ends = np.arange(first, min(first + CHUNK_WINDOWS, len(days)))
+            matrices = {name: _windowed(values, lo[ends], ends, window)
+                        for name, values in columns.items()}
+            # Pairwise comparisons are shared by every pair a column appears in.
+            pairwise = {name: _pairwise(matrix) for name, matrix in matrices.items()}
+            for driver in drivers:
+                for sentiment in sentiments:
+                    values = _correlations(matrices[driver], matrices[sentiment],
+                                           pairwise[driver], pairwise[sentiment])
+                    for method, series in zip(METHODS, values):
+                        results[column_name(driver, sentiment, method, window)][ends] = series
+    return results
+
+
+def _compute_blocks(blocks, windows):
+    """Worker: rolling correlations for a batch of ``(start, stop, days, columns)`` blocks."""
+    return [(start, stop, rolling_block(days, columns, windows))
+            for start, stop, days, columns in blocks]
+
+
+def _batches(index, names, tasks):
+    blocks = [(start, stop, index.days[start:stop],
+               {name: index.arrays[name][start:stop] for name in names})
+              for start, stop in index.bounds.values()]
+    size = max(1, -(-len(blocks) // tasks))
+    return [blocks[i:i + size] for i in range(0, len(blocks), size)]
+
+
+def compute(table, windows=WINDOWS, max_workers=None):
+    """Arrow table of rolling correlations aligned row for row with the dataset ``table``."""
+    index = LocationIndex(table)
+    names = DRIVERS + SENTIMENTS
+    output = {column_name(driver, sentiment, method, window): np.full(len(index), np.nan,
+                                                                      dtype=np.float32)
+              for window in windows for driver in DRIVERS for sentiment in SENTIMENTS
+              for method in METHODS}
+
+    # A few batches per worker keeps the pool busy when location lengths differ.
+    batches = _batches(index, names, 4 * (max_workers or os.cpu_count() or 1))
+    with span("rolling_compute", rows=len(index), windows=len(windows)), \
+            ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for results in pool.map(_compute_blocks, batches, [windows] * len(batches)):
+            for start, stop, block in results:
+                for name, values in block.items():
+                    output[name][start:stop] = values
+
+    columns = [table.column("location"), table.column("date")] + \
+        [pa.array(values) for values in output.values()]
+    return pa.table(columns, names=["location", "date"] + list(output),
+                    metadata={WINDOWS_KEY: json.dumps(list(windows)).encode()})
+
+
+def file_version(path):
+    """Stat-based token that changes whenever the file at ``path`` is rewritten."""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load(path, dataset):
+    """Map the rolling correlations at ``path``, or None if missing or computed from other data."""
+    if data_store.read_fingerprint(path) != data_store.dataset_fingerprint(dataset):
+        return None
+    return data_store.map_table(path)
+
+
+def windows_of(table):
+    return json.loads(table.schema.metadata[WINDOWS_KEY])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--data", default=".", help="Spark output directory")
+    parser.add_argument("--cache", default=data_store.CACHE_DIR)
+    parser.add_argument("--windows", type=int, nargs="+", default=WINDOWS,
+                        help="window lengths in days")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--output", help="result file (default: <cache>/{})".format(ROLLING_FILE))
+    args = parser.parse_args()
+
+    table = data_store.load_table(args.data, args.cache, max_workers=args.workers)
+    result = compute(table, sorted(set(args.windows)), max_workers=args.workers)
+    output = args.output or os.path.join(args.cache, ROLLING_FILE)
+    data_store.write_table(result, output, data_store.dataset_fingerprint(table))
+    print("Wrote {} correlation series for {:,} rows to {}".format(
+        result.num_columns - 2, result.num_rows, output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Generate synthetic Spark output with the dashboard's schema at production scale.
+
+Writes ``part-*.csv`` partitions with the same columns, date format and missing
+value markers as the real aggregated output, for any number of locations and
+days. Missing data follows the real file: some locations have no
+reproduction_rate at all (like Hong Kong), weekly ICU admissions are mostly
+empty or "-", vaccination figures have scattered gaps, and some location-days
+are absent altogether.
+
+    python synthetic_data.py out_dir --locations 2000 --days 1095 --partitions 16
+"""
+import argparse
+import datetime as dt
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["location", "date", "stringency_index", "reproduction_rate",
+           "new_deaths_smoothed_per_million", "weekly_icu_admissions_per_million",
+           "people_vaccinated_per_hundred", "human_development_index",
+           "%_of_mixed_sentiments", "%_of_negative_sentiments",
+           "%_of_neutral_sentiments", "%_of_positive_sentiments"]
+
+
+def _random_walk(rng, shape, start, step, low, high):
+    walk = start + np.cumsum(rng.normal(0, step, shape), axis=1)
+    return np.clip(walk, low, high)
+
+
+def generate(n_locations, n_days, start_date=dt.date(2022, 1, 1), seed=0,
+             missing_day_rate=0.01):
+    """Return a DataFrame in the Spark output layout (dates as d/m/Y strings)."""
+    rng = np.random.default_rng(seed)
+    shape = (n_locations, n_days)
+    locations = np.array(["Location {:05d}".format(i) for i in range(n_locations)], dtype=object)
+
+    stringency = np.round(_random_walk(rng, shape, rng.uniform(20, 80, (n_locations, 1)),
+                                       1.5, 0, 100), 2)
+    reproduction = np.round(_random_walk(rng, shape, rng.uniform(0.6, 1.6, (n_locations, 1)),
+                                         0.03, 0.1, 3), 2)
+    reproduction[rng.random(n_locations) < 0.05] = np.nan
+    deaths = np.round(np.abs(_random_walk(rng, shape, rng.uniform(0, 5, (n_locations, 1)),
+                                          0.3, 0, 50)), 3)
+    deaths[rng.random(shape) < 0.003] = np.nan
+    icu = np.round(np.abs(_random_walk(rng, shape, rng.uniform(5, 40, (n_locations, 1)),
+                                       1.0, 0, 200)), 3)
+    icu[rng.random(shape) < 0.3] = np.nan
+    icu_reported = rng.random(n_locations) < 0.3
+    icu[~icu_reported] = np.nan
+    vaccinated = np.round(np.minimum(
+        rng.uniform(10, 60, (n_locations, 1)) + np.cumsum(rng.uniform(0, 0.2, shape), axis=1), 99), 2)
+    vaccinated[rng.random(shape) < 0.15] = np.nan
+    hdi = np.repeat(np.round(rng.uniform(0.4, 0.96, (n_locations, 1)), 3), n_days, axis=1)
+    hdi[rng.random(n_locations) < 0.05] = np.nan
+
+    # Sentiment shares are a Dirichlet draw per location-day, in percent.
+    shares = rng.dirichlet([0.5, 8, 12, 1.5], size=shape) * 100
+
+    dates = [start_date + dt.timedelta(days=i) for i in range(n_days)]
+    date_labels = np.array(["{}/{}/{}".format(d.day, d.month, d.year) for d in dates], dtype=object)
+
+    df = pd.DataFrame({
+        "location": np.repeat(locations, n_days),
+        "date": np.tile(date_labels, n_locations),
+        "stringency_index": stringency.ravel(),
+        "reproduction_rate": reproduction.ravel(),
+        "new_deaths_smoothed_per_million": deaths.ravel(),
+        "weekly_icu_admissions_per_million": icu.ravel(),
+        "people_vaccinated_per_hundred": vaccinated.ravel(),
+        "human_development_index": hdi.ravel(),
+        "%_of_mixed_sentiments": shares[..., 0].ravel(),
+        "%_of_negative_sentiments": shares[..., 1].ravel(),
+        "%_of_neutral_sentiments": shares[..., 2].ravel(),
+        "%_of_positive_sentiments": shares[..., 3].ravel(),
+    }, columns=COLUMNS)
+
+    # The real ICU column mixes empty cells and "-" for missing values.
+    icu_column = df["weekly_icu_admissions_per_million"].astype(object)
+    icu_column[icu_column.isna() & (rng.random(len(df)) < 0.5)] = "-"
+    df["weekly_icu_admissions_per_million"] = icu_column
+    return df[rng.random(len(df)) >= missing_day_rate]
+
+
+def write_partitions(df, out_dir, n_partitions, seed=0):
+    """Write ``df`` as shuffled ``part-NNNNN-<uuid>-c000.csv`` files, like a Spark job."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    run_id = uuid.UUID(bytes=rng.bytes(16), version=4)
+    order = rng.permutation(len(df))
+    paths = []
+    for part, rows in enumerate(np.array_split(order, n_partitions)):
+        path = os.path.join(out_dir, "part-{:05d}-{}-c000.csv".format(part, run_id))
+        df.iloc[rows].to_csv(path, index=False, na_rep="")
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--locations", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = generate(args.locations, args.days, seed=args.seed)
+    paths = write_partitions(df, args.out_dir, args.partitions, seed=args.seed)
+    print("Wrote {:,} rows to {} partitions in {}".format(len(df), len(paths), args.out_dir))
+
+
+if __name__ == "__main__":
+    main()